@@ -1,38 +1,40 @@
 #!/usr/bin/env python3
 """nanocode - minimal gemini code alternative"""
 
-import glob as globlib, json, os, re, subprocess, urllib.request
+import collections, concurrent.futures, functools, glob as globlib, http.client, itertools, json, os, re, selectors, signal, stat, subprocess, sys, time, urllib.parse, urllib.request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_ENV_LINE_RE = re.compile(
+    r"^[ \t]*(?:export[ \t]+)?([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*(.*?)[ \t\r]*$",
+    re.M,
+)
 
 
 def load_dotenv(paths):
+    parsed = {}
     for path in paths:
         if not path or not os.path.isfile(path):
             continue
         try:
             with open(path) as f:
-                for line in f:
-                    stripped = line.strip()
-                    if not stripped or stripped.startswith("#"):
-                        continue
-                    if stripped.startswith("export "):
-                        stripped = stripped[len("export ") :].lstrip()
-                    if "=" not in stripped:
-                        continue
-                    key, value = stripped.split("=", 1)
-                    key = key.strip()
-                    value = value.strip()
-                    if not key:
-                        continue
-                    if (
-                        (value.startswith("'") and value.endswith("'"))
-                        or (value.startswith('"') and value.endswith('"'))
-                    ):
-                        value = value[1:-1]
-                    elif "#" in value:
-                        value = value.split("#", 1)[0].rstrip()
-                    os.environ.setdefault(key, value)
+                text = f.read()
         except OSError:
             continue
+        for key, value in _ENV_LINE_RE.findall(text):
+            if (
+                (value.startswith("'") and value.endswith("'"))
+                or (value.startswith('"') and value.endswith('"'))
+            ):
+                value = value[1:-1]
+            elif "#" in value:
+                value = value.split("#", 1)[0].rstrip()
+            parsed.setdefault(key, value)
+    os.environ.update({k: v for k, v in parsed.items() if k not in os.environ})
 
 
 load_dotenv(
@@ -55,85 +57,231 @@ BLUE, CYAN, GREEN, YELLOW, RED = (
     "\033[33m",
     "\033[31m",
 )
+_ECHO_PREFIX, _ECHO_SUFFIX = f"  {DIM}│ ".encode(), f"{RESET}\n".encode()
+GREP_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+_MD_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
 
 
 # --- Tool implementations ---
 
 
 def read(args):
-    lines = open(args["path"]).readlines()
     offset = args.get("offset", 0)
-    limit = args.get("limit", len(lines))
-    selected = lines[offset : offset + limit]
-    return "".join(f"{offset + idx + 1:4}| {line}" for idx, line in enumerate(selected))
+    limit = args.get("limit")
+    stop = offset + limit if limit is not None else None
+    with open(args["path"]) as f:
+        if offset < 0 or (limit is not None and limit < 0):
+            # negative values count from the end, so keep list-slice semantics
+            lines = f.readlines()
+            if limit is None:
+                limit = len(lines)
+            selected = lines[offset : offset + limit]
+        else:
+            selected = itertools.islice(f, offset, stop)
+        return "".join(f"{offset + idx + 1:4}| {line}" for idx, line in enumerate(selected))
+
+
+def _write_file(path, content):
+    # replace via temp file + rename so readers never see a partial file; the
+    # new inode keeps mode and (where permitted) owner/group, but not ACLs or
+    # xattrs. Hard-linked files and read-only directories are written in place.
+    path = os.path.realpath(path)
+    data = content.encode()
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if st and (st.st_nlink > 1 or not os.access(os.path.dirname(path), os.W_OK)):
+        with open(path, "wb") as f:
+            f.write(data)
+        return
+    tmp = path + ".nctmp"
+    try:
+        with open(tmp, "wb", buffering=0) as f:
+            view = memoryview(data)
+            while view:
+                view = view[f.write(view) :]
+        if st:
+            os.chmod(tmp, stat.S_IMODE(st.st_mode))
+            try:
+                os.chown(tmp, st.st_uid, st.st_gid)
+            except OSError:
+                pass
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
 
 
 def write(args):
-    with open(args["path"], "w") as f:
-        f.write(args["content"])
+    _write_file(args["path"], args["content"])
     return "ok"
 
 
 def edit(args):
-    text = open(args["path"]).read()
+    with open(args["path"]) as f:
+        text = f.read()
     old, new = args["old"], args["new"]
-    if old not in text:
+    idx = text.find(old)
+    if idx < 0:
         return "error: old_string not found"
-    count = text.count(old)
-    if not args.get("all") and count > 1:
+    if args.get("all"):
+        replacement = text.replace(old, new)
+    elif text.find(old, idx + max(len(old), 1)) >= 0:
+        count = text.count(old)
         return f"error: old_string appears {count} times, must be unique (use all=true)"
-    replacement = (
-        text.replace(old, new) if args.get("all") else text.replace(old, new, 1)
-    )
-    with open(args["path"], "w") as f:
-        f.write(replacement)
+    else:
+        replacement = text[:idx] + new + text[idx + len(old) :]
+    _write_file(args["path"], replacement)
     return "ok"
 
 
+def _file_mtime(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    return st.st_mtime if stat.S_ISREG(st.st_mode) else 0
+
+
 def glob(args):
     pattern = (args.get("path", ".") + "/" + args["pat"]).replace("//", "/")
     files = globlib.glob(pattern, recursive=True)
-    files = sorted(
-        files,
-        key=lambda f: os.path.getmtime(f) if os.path.isfile(f) else 0,
-        reverse=True,
-    )
+    files = sorted(files, key=_file_mtime, reverse=True)
     return "\n".join(files) or "none"
 
 
-def grep(args):
-    pattern = re.compile(args["pat"])
-    hits = []
-    for filepath in globlib.glob(args.get("path", ".") + "/**", recursive=True):
+def _walk(root):
+    stack = [root]
+    while stack:
         try:
-            for line_num, line in enumerate(open(filepath), 1):
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_grep(pat):
+    return re.compile(pat)
+
+
+def _grep_file(filepath, pattern):
+    hits = []
+    try:
+        with open(filepath, encoding="utf-8", errors="replace") as f:
+            if b"\0" in f.buffer.peek(8192)[:8192]:
+                return hits
+            for line_num, line in enumerate(f, 1):
                 if pattern.search(line):
                     hits.append(f"{filepath}:{line_num}:{line.rstrip()}")
-        except Exception:
-            pass
+                    if len(hits) >= 50:
+                        break
+    except OSError:
+        pass
+    return hits
+
+
+def grep(args):
+    pattern = _compile_grep(args["pat"])
+    hits = []
+    # files are scanned concurrently but collected in walk order through a
+    # bounded window, so output is stable and the walk stops at 50 hits
+    with concurrent.futures.ThreadPoolExecutor(GREP_WORKERS) as pool:
+        pending = collections.deque()
+        for filepath in _walk(args.get("path", ".")):
+            pending.append(pool.submit(_grep_file, filepath, pattern))
+            if len(pending) < GREP_WORKERS * 4:
+                continue
+            hits.extend(pending.popleft().result())
+            if len(hits) >= 50:
+                break
+        while pending and len(hits) < 50:
+            hits.extend(pending.popleft().result())
+        pool.shutdown(cancel_futures=True)
     return "\n".join(hits[:50]) or "none"
 
 
+def _echo_lines(lines):
+    out = sys.stdout.buffer
+    out.write(b"".join(_ECHO_PREFIX + line.rstrip() + _ECHO_SUFFIX for line in lines))
+    out.flush()
+
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    proc.wait()
+
+
 def bash(args):
+    sys.stdout.flush()
     proc = subprocess.Popen(
         args["cmd"], shell=True,
         stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-        text=True
+        start_new_session=True
     )
-    output_lines = []
+    deadline = time.monotonic() + 30
+    fd = proc.stdout.fileno()
+    # pending holds the pieces of the current unterminated line, so long
+    # lines are joined once instead of being re-copied on every read
+    chunks, pending = [], []
+    skip_lf = False
     try:
-        while True:
-            line = proc.stdout.readline()
-            if not line and proc.poll() is not None:
-                break
-            if line:
-                print(f"  {DIM}│ {line.rstrip()}{RESET}", flush=True)
-                output_lines.append(line)
-        proc.wait(timeout=30)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        output_lines.append("\n(timed out after 30s)")
-    return "".join(output_lines).strip() or "(empty)"
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                if time.monotonic() > deadline:
+                    raise subprocess.TimeoutExpired(args["cmd"], 30)
+                if not selector.select(timeout=0.1):
+                    continue
+                chunk = os.read(fd, 1 << 16)
+                if not chunk:
+                    break
+                # universal newlines: \r\n and bare \r (progress output) end
+                # a line; a \r\n split across reads must not count twice
+                if skip_lf and chunk.startswith(b"\n"):
+                    chunk = chunk[1:]
+                skip_lf = chunk.endswith(b"\r")
+                chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+                if not chunk:
+                    continue
+                chunks.append(chunk)
+                if b"\n" not in chunk:
+                    pending.append(chunk)
+                    continue
+                first, *lines, tail = chunk.split(b"\n")
+                pending.append(first)
+                _echo_lines([b"".join(pending), *lines])
+                pending = [tail] if tail else []
+        if pending:
+            _echo_lines([b"".join(pending)])
+        proc.wait(timeout=max(deadline - time.monotonic(), 0))
+    except BaseException as err:
+        # the command runs in its own session, so Ctrl-C doesn't reach it;
+        # kill the whole group on timeout, interrupt or any other error
+        _kill_group(proc)
+        if not isinstance(err, subprocess.TimeoutExpired):
+            raise
+        chunks.append(b"\n(timed out after 30s)")
+    finally:
+        proc.stdout.close()
+    return b"".join(chunks).decode(errors="replace").strip() or "(empty)"
 
 
 # --- Tool definitions: (description, schema, function) ---
@@ -171,6 +319,16 @@ TOOLS = {
     ),
 }
 
+# argument shown next to the tool name when a call is printed
+PREVIEW_FIELDS = {
+    "read": "path",
+    "write": "path",
+    "edit": "path",
+    "glob": "pat",
+    "grep": "pat",
+    "bash": "cmd",
+}
+
 
 def run_tool(name, args):
     try:
@@ -209,36 +367,106 @@ def make_schema():
     return result
 
 
+SCHEMA = make_schema()
+
+
+_API = urllib.parse.urlsplit(API_URL)
+_connection = None
+
+
+def _proxied():
+    proxy = urllib.request.getproxies().get("https")
+    return bool(proxy) and not urllib.request.proxy_bypass(_API.hostname)
+
+
+def _post(body, headers):
+    global _connection
+    for attempt in range(2):
+        reused = _connection is not None
+        if not reused:
+            _connection = http.client.HTTPSConnection(_API.hostname, _API.port)
+        try:
+            _connection.request("POST", _API.path, body=body, headers=headers)
+            response = _connection.getresponse()
+            break
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # idle keep-alive socket was closed by the server before any
+            # response arrived; retry once on a fresh one
+            _connection.close()
+            _connection = None
+            if not reused or attempt:
+                raise
+        except Exception:
+            _connection.close()
+            _connection = None
+            raise
+    try:
+        # failures past this point may follow a processed request: never retry
+        data = response.read()
+    except Exception:
+        _connection.close()
+        _connection = None
+        raise
+    if response.status >= 400:
+        raise RuntimeError(f"HTTP Error {response.status}: {response.reason}")
+    return data
+
+
+def _dumps(payload):
+    if orjson:
+        try:
+            return orjson.dumps(payload)
+        except orjson.JSONEncodeError:
+            # e.g. lone surrogates from non-UTF-8 paths, which json escapes
+            pass
+    return json.dumps(payload).encode()
+
+
 def call_api(input_data, system_prompt, previous_interaction_id=None):
     if not GEMINI_API_KEY:
         raise RuntimeError("Missing GEMINI_API_KEY")
     payload = {
         "model": MODEL,
         "input": input_data,
-        "tools": make_schema(),
+        "tools": SCHEMA,
         "system_instruction": system_prompt,
         "generation_config": {"max_output_tokens": 8192},
     }
     if previous_interaction_id:
         payload["previous_interaction_id"] = previous_interaction_id
-    request = urllib.request.Request(
-        API_URL,
-        data=json.dumps(payload).encode(),
-        headers={
-            "Content-Type": "application/json",
-            "x-goog-api-key": GEMINI_API_KEY,
-        },
-    )
-    response = urllib.request.urlopen(request)
-    return json.loads(response.read())
+    body = _dumps(payload)
+    headers = {
+        "Content-Type": "application/json",
+        "x-goog-api-key": GEMINI_API_KEY,
+    }
+    if _proxied():
+        # urlopen handles every proxy URL form and proxy credentials
+        request = urllib.request.Request(API_URL, data=body, headers=headers)
+        with urllib.request.urlopen(request) as response:
+            data = response.read()
+    else:
+        data = _post(body, headers)
+    return (orjson or json).loads(data)
+
+
+_separator_cache = None
+
+
+def invalidate_separator(*_):
+    global _separator_cache
+    _separator_cache = None
 
 
 def separator():
-    return f"{DIM}{'─' * min(os.get_terminal_size().columns, 80)}{RESET}"
+    global _separator_cache
+    if _separator_cache is None:
+        width = min(os.get_terminal_size().columns, 80)
+        _separator_cache = f"{DIM}{'─' * width}{RESET}"
+    return _separator_cache
 
 
 def render_markdown(text):
-    return re.sub(r"\*\*(.+?)\*\*", f"{BOLD}\\1{RESET}", text)
+    return _MD_BOLD_RE.sub(f"{BOLD}\\1{RESET}", text)
 
 
 def normalize_tool_args(tool_args):
@@ -254,9 +482,14 @@ def normalize_tool_args(tool_args):
     return None, f"error: tool arguments must be object, got {type(tool_args).__name__}"
 
 
-def preview_tool_args(tool_args):
+def preview_tool_args(name, tool_args):
     if isinstance(tool_args, dict) and tool_args:
-        return str(next(iter(tool_args.values())))[:50]
+        value = tool_args.get(PREVIEW_FIELDS.get(name))
+        if value is None:
+            value = next(iter(tool_args.values()))
+        return value[:50] if isinstance(value, str) else str(value)[:50]
+    if isinstance(tool_args, str):
+        return tool_args[:50]
     if tool_args:
         return str(tool_args)[:50]
     return ""
@@ -277,6 +510,8 @@ def main():
     print(f"{BOLD}nanocode{RESET} | {DIM}{MODEL} (Gemini) | {os.getcwd()}{RESET}\n")
     previous_interaction_id = None
     system_prompt = f"Concise coding assistant. cwd: {os.getcwd()}"
+    if hasattr(signal, "SIGWINCH"):
+        signal.signal(signal.SIGWINCH, invalidate_separator)
 
     while True:
         try:
@@ -308,7 +543,7 @@ def main():
                 for call in tool_calls:
                     tool_name = call.get("name", "")
                     raw_args = call.get("arguments", {})
-                    arg_preview = preview_tool_args(raw_args)
+                    arg_preview = preview_tool_args(tool_name, raw_args)
                     print(
                         f"\n{GREEN}⏺ {tool_name.capitalize()}{RESET}({DIM}{arg_preview}{RESET})"
                     )
@@ -318,11 +553,12 @@ def main():
                         result = arg_error
                     else:
                         result = run_tool(tool_name, tool_args)
-                    result_lines = result.split("\n")
-                    preview = result_lines[0][:60]
-                    if len(result_lines) > 1:
-                        preview += f" ... +{len(result_lines) - 1} lines"
-                    elif len(result_lines[0]) > 60:
+                    first_line = result.partition("\n")[0]
+                    extra_lines = result.count("\n")
+                    preview = first_line[:60]
+                    if extra_lines:
+                        preview += f" ... +{extra_lines} lines"
+                    elif len(first_line) > 60:
                         preview += "..."
                     print(f"  {DIM}⎿  {preview}{RESET}")
 